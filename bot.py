@@ -1,3 +1,4 @@
+import asyncio
 import datetime
 import platform
 if platform.system() == "Windows":
@@ -5,6 +6,11 @@ if platform.system() == "Windows":
 else:
     NULL = None  # fallback on Linux
 
+try:
+    import uvloop  # faster event loop, not available on Windows
+except ImportError:
+    uvloop = None
+
 import pandas as pd
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
@@ -19,9 +25,33 @@ logger = logging.getLogger(__name__)
 class PotholeBot:
     def __init__(self, db: PotholeDatabase):
         self.db = db
-        self.application = Application.builder().token(config.BOT_TOKEN).build()
+        # Rendered /map reply, reused until the pothole table changes
+        self._map_cache = {'fingerprint': None, 'message': None}
+        # Coroutine functions run as tasks on the bot's event loop while it polls
+        self._background_jobs = []
+        self._background_tasks = []
+        self.application = (
+            Application.builder()
+            .token(config.BOT_TOKEN)
+            .post_init(self._start_background_jobs)
+            .post_shutdown(self._stop_background_jobs)
+            .build()
+        )
         self.setup_handlers()
 
+    def add_background_job(self, job):
+        """Register a coroutine function to run on the bot's event loop"""
+        self._background_jobs.append(job)
+
+    async def _start_background_jobs(self, application: Application) -> None:
+        self._background_tasks = [asyncio.create_task(job()) for job in self._background_jobs]
+
+    async def _stop_background_jobs(self, application: Application) -> None:
+        for task in self._background_tasks:
+            task.cancel()
+        await asyncio.gather(*self._background_tasks, return_exceptions=True)
+        self._background_tasks = []
+
     def setup_handlers(self):
         """Set up bot command handlers"""
         self.application.add_handler(CommandHandler('start', self.start))
@@ -47,7 +77,8 @@ class PotholeBot:
         self.application.add_handler(CallbackQueryHandler(self.send_location, pattern=r'^-?\d+\.\d+,-?\d+\.\d+$'))
 
         self.application.add_handler(CommandHandler('severity', self.display_by_severity))
-        self.application.add_handler(CommandHandler('export', self.export_csv))
+        # Uploads can take a while; block=False lets other updates be handled meanwhile
+        self.application.add_handler(CommandHandler('export', self.export_csv, block=False))
 
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Send welcome message"""
@@ -70,25 +101,32 @@ class PotholeBot:
         severity_stats = stats['by_severity']
         top_regions = stats['top_regions']
 
-        message = f"*📊 Pothole Detection Statistics*\n\nTotal Potholes Detected: {total}\n"
+        lines = [f"*📊 Pothole Detection Statistics*\n\nTotal Potholes Detected: {total}\n"]
         for severity, count in severity_stats.items():
-            message += f"{severity.capitalize()}: {count}\n"
+            lines.append(f"{severity.capitalize()}: {count}\n")
 
-        message += "\n*Top Regions:*\n"
+        lines.append("\n*Top Regions:*\n")
         for region, count in top_regions:
-            message += f"• {region}: {count} potholes\n"
+            lines.append(f"• {region}: {count} potholes\n")
 
+        # One join instead of re-copying the growing string on every +=
+        message = "".join(lines)
         await update.message.reply_text(message, parse_mode='Markdown')
 
     async def send_map(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Send Google Maps link with all pothole locations"""
-        potholes = self.db.get_potholes()
-        if not potholes:
+        fingerprint = self.db.get_fingerprint()
+        if fingerprint == self._map_cache['fingerprint']:
+            await update.message.reply_text(self._map_cache['message'], parse_mode='Markdown')
+            return
+
+        coordinates = self.db.get_coordinates()
+        if not coordinates:
             await update.message.reply_text("No pothole locations available.")
             return
 
         base_url = "https://www.google.com/maps/dir/?api=1"
-        locations = [f"{p.latitude},{p.longitude}" for p in potholes]
+        locations = [f"{latitude},{longitude}" for latitude, longitude in coordinates]
         destination = locations[0]
         waypoints = "|".join(locations[1:])
 
@@ -97,32 +135,25 @@ class PotholeBot:
             import urllib
             url += f"&waypoints={urllib.parse.quote(waypoints)}"
 
-        message = f"📍 *Pothole Locations Map*\n\nTotal locations: {len(potholes)}\n"
+        message = f"📍 *Pothole Locations Map*\n\nTotal locations: {len(coordinates)}\n"
         message += f"[View on Google Maps]({url})"
+        self._map_cache = {'fingerprint': fingerprint, 'message': message}
         await update.message.reply_text(message, parse_mode='Markdown')
 
     async def display_locations(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Display regions with pothole detections"""
-        # Get all potholes
-        potholes = self.db.get_potholes()
-
-        if not potholes:
-            await update.message.reply_text("No pothole locations available.")
-            return
-
-        # Extract unique regions and count potholes per region
-        region_counts = {}
-        for pothole in potholes:
-            if pothole.region:
-                region_counts[pothole.region] = region_counts.get(pothole.region, 0) + 1
+        # Count potholes per region in SQL rather than loading every pothole
+        region_counts = self.db.get_region_counts()
 
         if not region_counts:
-            await update.message.reply_text("No regions with pothole data available.")
+            if self.db.count_potholes():
+                await update.message.reply_text("No regions with pothole data available.")
+            else:
+                await update.message.reply_text("No pothole locations available.")
             return
 
         keyboard = []
-        for region in sorted(region_counts.keys()):
-            count = region_counts[region]
+        for region, count in region_counts.items():
             button_text = f"{region} ({count} potholes)"
             callback_data = f"region:{region}:all:0"  # region:name:filter:page
             keyboard.append([InlineKeyboardButton(button_text, callback_data=callback_data)])
@@ -146,26 +177,26 @@ class PotholeBot:
 
         ITEMS_PER_PAGE = 5
 
-        # Get potholes for the region
+        # Count the region's potholes in SQL and load only the current page
         if sort_by == "all":
-            potholes = self.db.get_potholes(filters={'region': region}, sort_by='timestamp', sort_order='DESC')
+            filters = {'region': region}
+            order_by = 'timestamp'
         else:
             # Filter by both region and severity
-            potholes = self.db.get_potholes(
-                filters={'region': region, 'severity': sort_by},
-                sort_by='depth',
-                sort_order='DESC'
-            )
+            filters = {'region': region, 'severity': sort_by}
+            order_by = 'depth'
 
-        if not potholes:
+        total = self.db.count_potholes(filters)
+        if not total:
             await query.message.edit_text(f"No potholes found in {region}" +
                                           (f" with {sort_by} severity." if sort_by != "all" else "."))
             return
 
         # Calculate pagination
-        total_pages = (len(potholes) + ITEMS_PER_PAGE - 1) // ITEMS_PER_PAGE
+        total_pages = (total + ITEMS_PER_PAGE - 1) // ITEMS_PER_PAGE
         start_idx = page * ITEMS_PER_PAGE
-        end_idx = min(start_idx + ITEMS_PER_PAGE, len(potholes))
+        potholes = self.db.get_potholes(filters=filters, sort_by=order_by, sort_order='DESC',
+                                        limit=ITEMS_PER_PAGE, offset=start_idx)
 
         # Build message
         severity_emojis = {
@@ -179,14 +210,16 @@ class PotholeBot:
         if sort_by != "all":
             title += f" - {sort_by.capitalize()} Severity"
 
-        message = f"{title}\n"
-        message += f"_Page {page + 1} of {total_pages} • Total: {len(potholes)} potholes_\n\n"
+        lines = [
+            f"{title}\n",
+            f"_Page {page + 1} of {total_pages} • Total: {total} potholes_\n\n"
+        ]
 
         # Display potholes with proper data type handling
-        for i, pothole in enumerate(potholes[start_idx:end_idx], start=start_idx + 1):
+        for i, pothole in enumerate(potholes, start=start_idx + 1):
             emoji = severity_emojis.get(pothole.severity.value, '⚪')
-            message += f"{i}. {emoji} *{pothole.city}*\n"
-            message += f"   Severity: {pothole.severity.value.capitalize()}\n"
+            lines.append(f"{i}. {emoji} *{pothole.city}*\n")
+            lines.append(f"   Severity: {pothole.severity.value.capitalize()}\n")
 
             # Handle depth and area with proper type conversion
             try:
@@ -207,12 +240,13 @@ class PotholeBot:
                 else:
                     area = float(pothole.area) if pothole.area is not None else 0.0
 
-                message += f"   📏 Depth: {depth_cm:.1f}cm | 📐 Area: {area:.0f}px\n"
+                lines.append(f"   📏 Depth: {depth_cm:.1f}cm | 📐 Area: {area:.0f}px\n")
             except (ValueError, AttributeError, UnicodeDecodeError) as e:
                 logger.error(f"Error converting depth/area for pothole {i}: {e}")
-                message += f"   📏 Depth: N/A | 📐 Area: N/A\n"
+                lines.append(f"   📏 Depth: N/A | 📐 Area: N/A\n")
 
-            message += f"   📍 `{pothole.latitude:.4f}, {pothole.longitude:.4f}`\n\n"
+            lines.append(f"   📍 `{pothole.latitude:.4f}, {pothole.longitude:.4f}`\n\n")
+        message = "".join(lines)
 
         # Rest of the method remains the same...
         # Build keyboard
@@ -253,7 +287,7 @@ class PotholeBot:
             keyboard.append(nav_buttons)
 
         # Add location buttons for current page
-        for pothole in potholes[start_idx:end_idx]:
+        for pothole in potholes:
             location_text = f"📍 View on map: {pothole.city}"
             location_data = f"{pothole.latitude},{pothole.longitude}"
             keyboard.append([InlineKeyboardButton(location_text, callback_data=location_data)])
@@ -279,22 +313,26 @@ class PotholeBot:
 
         ITEMS_PER_PAGE = 5
 
-        # Get potholes based on severity
+        # Count matching potholes in SQL and load only the current page
         if severity == "all":
-            potholes = self.db.get_potholes(sort_by='severity', sort_order='DESC')
+            filters = None
+            order_by = 'severity'
             title = "All Potholes (sorted by severity)"
         else:
-            potholes = self.db.get_potholes(filters={'severity': severity}, sort_by='depth', sort_order='DESC')
+            filters = {'severity': severity}
+            order_by = 'depth'
             title = f"{severity.capitalize()} Severity Potholes"
 
-        if not potholes:
+        total = self.db.count_potholes(filters)
+        if not total:
             await query.message.edit_text(f"No {severity} severity potholes found.")
             return
 
         # Calculate pagination
-        total_pages = (len(potholes) + ITEMS_PER_PAGE - 1) // ITEMS_PER_PAGE
+        total_pages = (total + ITEMS_PER_PAGE - 1) // ITEMS_PER_PAGE
         start_idx = page * ITEMS_PER_PAGE
-        end_idx = min(start_idx + ITEMS_PER_PAGE, len(potholes))
+        potholes = self.db.get_potholes(filters=filters, sort_by=order_by, sort_order='DESC',
+                                        limit=ITEMS_PER_PAGE, offset=start_idx)
 
         # Build message
         severity_emojis = {
@@ -304,12 +342,14 @@ class PotholeBot:
             'critical': '🔴'
         }
 
-        message = f"*{title}*\n"
-        message += f"_Page {page + 1} of {total_pages} • Total: {len(potholes)} potholes_\n\n"
+        lines = [
+            f"*{title}*\n",
+            f"_Page {page + 1} of {total_pages} • Total: {total} potholes_\n\n"
+        ]
 
-        for i, p in enumerate(potholes[start_idx:end_idx], start=start_idx + 1):
+        for i, p in enumerate(potholes, start=start_idx + 1):
             emoji = severity_emojis.get(p.severity.value, '⚪')
-            message += f"{i}. {emoji} *{p.severity.value.upper()}* - {p.city}, {p.region}\n"
+            lines.append(f"{i}. {emoji} *{p.severity.value.upper()}* - {p.city}, {p.region}\n")
 
             # Handle depth and area with proper type conversion
             try:
@@ -328,13 +368,14 @@ class PotholeBot:
                 else:
                     area = float(p.area) if p.area is not None else 0.0
 
-                message += f"   📏 Depth: {depth_cm:.1f}cm | 📐 Area: {area:.0f}px\n"
+                lines.append(f"   📏 Depth: {depth_cm:.1f}cm | 📐 Area: {area:.0f}px\n")
             except (ValueError, AttributeError, UnicodeDecodeError) as e:
                 logger.error(f"Error converting depth/area for pothole {i}: {e}")
-                message += f"   📏 Depth: N/A | 📐 Area: N/A\n"
+                lines.append(f"   📏 Depth: N/A | 📐 Area: N/A\n")
 
-            message += f"   📍 Location: `{p.latitude:.4f}, {p.longitude:.4f}`\n"
-            message += f"   🕒 {p.timestamp.strftime('%Y-%m-%d %H:%M')}\n\n"
+            lines.append(f"   📍 Location: `{p.latitude:.4f}, {p.longitude:.4f}`\n")
+            lines.append(f"   🕒 {p.timestamp.strftime('%Y-%m-%d %H:%M')}\n\n")
+        message = "".join(lines)
 
         # Build pagination keyboard
         keyboard = []
@@ -350,7 +391,7 @@ class PotholeBot:
             keyboard.append(nav_buttons)
 
         # Add location buttons for current page items
-        for p in potholes[start_idx:end_idx]:
+        for p in potholes:
             location_text = f"📍 View on map: {p.city}"
             location_data = f"{p.latitude},{p.longitude}"
             keyboard.append([InlineKeyboardButton(location_text, callback_data=location_data)])
@@ -439,22 +480,18 @@ class PotholeBot:
         query = update.callback_query
         await query.answer()
 
-        # Get all potholes to extract regions
-        potholes = self.db.get_potholes()
+        # Count potholes per region in SQL rather than loading every pothole
+        region_counts = self.db.get_region_counts()
 
-        if not potholes:
-            await query.message.edit_text("No pothole locations available.")
+        if not region_counts:
+            if self.db.count_potholes():
+                await query.message.edit_text("No regions with pothole data available.")
+            else:
+                await query.message.edit_text("No pothole locations available.")
             return
 
-        # Extract unique regions and count
-        region_counts = {}
-        for pothole in potholes:
-            if pothole.region:
-                region_counts[pothole.region] = region_counts.get(pothole.region, 0) + 1
-
         keyboard = []
-        for region in sorted(region_counts.keys()):
-            count = region_counts[region]
+        for region, count in region_counts.items():
             button_text = f"{region} ({count} potholes)"
             callback_data = f"region:{region}:all:0"  # Default to show all
             keyboard.append([InlineKeyboardButton(button_text, callback_data=callback_data)])
@@ -490,7 +527,15 @@ class PotholeBot:
 
     def run(self):
         """Start the bot"""
-        self.application.run_polling()
+        if uvloop is not None:
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        # Long-poll so idle periods cost one request per 50 s, and only receive
+        # the update types we have handlers for
+        self.application.run_polling(
+            timeout=50,
+            bootstrap_retries=-1,
+            allowed_updates=[Update.MESSAGE, Update.CALLBACK_QUERY]
+        )
 
     async def display_by_severity(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Display potholes sorted by severity"""
@@ -537,22 +582,26 @@ class PotholeBot:
 
         ITEMS_PER_PAGE = 5
 
-        # Get potholes based on severity
+        # Count matching potholes in SQL and load only the current page
         if severity == "all":
-            potholes = self.db.get_potholes(sort_by='severity', sort_order='DESC')
+            filters = None
+            order_by = 'severity'
             title = "All Potholes (sorted by severity)"
         else:
-            potholes = self.db.get_potholes(filters={'severity': severity}, sort_by='depth', sort_order='DESC')
+            filters = {'severity': severity}
+            order_by = 'depth'
             title = f"{severity.capitalize()} Severity Potholes"
 
-        if not potholes:
+        total = self.db.count_potholes(filters)
+        if not total:
             await query.message.edit_text(f"No {severity} severity potholes found.")
             return
 
         # Calculate pagination
-        total_pages = (len(potholes) + ITEMS_PER_PAGE - 1) // ITEMS_PER_PAGE
+        total_pages = (total + ITEMS_PER_PAGE - 1) // ITEMS_PER_PAGE
         start_idx = page * ITEMS_PER_PAGE
-        end_idx = min(start_idx + ITEMS_PER_PAGE, len(potholes))
+        potholes = self.db.get_potholes(filters=filters, sort_by=order_by, sort_order='DESC',
+                                        limit=ITEMS_PER_PAGE, offset=start_idx)
 
         # Build message
         severity_emojis = {
@@ -562,12 +611,14 @@ class PotholeBot:
             'critical': '🔴'
         }
 
-        message = f"*{title}*\n"
-        message += f"_Page {page + 1} of {total_pages} • Total: {len(potholes)} potholes_\n\n"
+        lines = [
+            f"*{title}*\n",
+            f"_Page {page + 1} of {total_pages} • Total: {total} potholes_\n\n"
+        ]
 
-        for i, p in enumerate(potholes[start_idx:end_idx], start=start_idx + 1):
+        for i, p in enumerate(potholes, start=start_idx + 1):
             emoji = severity_emojis.get(p.severity.value, '⚪')
-            message += f"{i}. {emoji} *{p.severity.value.upper()}* - {p.city}, {p.region}\n"
+            lines.append(f"{i}. {emoji} *{p.severity.value.upper()}* - {p.city}, {p.region}\n")
 
             # Handle depth and area with proper type conversion
             try:
@@ -583,13 +634,14 @@ class PotholeBot:
                 else:
                     area = float(p.area) if p.area is not None else 0.0
 
-                message += f"   📏 Depth: {depth:.3f}m | 📐 Area: {area:.0f}px\n"
+                lines.append(f"   📏 Depth: {depth:.3f}m | 📐 Area: {area:.0f}px\n")
             except (ValueError, AttributeError, UnicodeDecodeError) as e:
                 logger.error(f"Error converting depth/area for pothole {i}: {e}")
-                message += f"   📏 Depth: N/A | 📐 Area: N/A\n"
+                lines.append(f"   📏 Depth: N/A | 📐 Area: N/A\n")
 
-            message += f"   📍 Location: `{p.latitude:.4f}, {p.longitude:.4f}`\n"
-            message += f"   🕒 {p.timestamp.strftime('%Y-%m-%d %H:%M')}\n\n"
+            lines.append(f"   📍 Location: `{p.latitude:.4f}, {p.longitude:.4f}`\n")
+            lines.append(f"   🕒 {p.timestamp.strftime('%Y-%m-%d %H:%M')}\n\n")
+        message = "".join(lines)
 
         # Build pagination keyboard (rest remains the same)
         keyboard = []
@@ -605,7 +657,7 @@ class PotholeBot:
             keyboard.append(nav_buttons)
 
         # Add location buttons for current page items
-        for p in potholes[start_idx:end_idx]:
+        for p in potholes:
             location_text = f"📍 View on map: {p.city}"
             location_data = f"{p.latitude},{p.longitude}"
             keyboard.append([InlineKeyboardButton(location_text, callback_data=location_data)])
@@ -650,8 +702,6 @@ class PotholeBot:
         )
 
     async def export_csv(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        import os
-
         potholes = self.db.get_potholes()
         if not potholes:
             await update.message.reply_text("No data to export.")
@@ -661,21 +711,19 @@ class PotholeBot:
         data = [p.to_dict() for p in potholes]
         df = pd.DataFrame(data)
 
-        # Create CSV file
+        # Render the CSV in memory, no temporary file on disk
         timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
         filename = f"potholes_export_{timestamp}.csv"
-        filepath = os.path.join(config.EXPORT_DIR, filename)
-
-        df.to_csv(filepath, index=False)
+        csv_bytes = df.to_csv(index=False).encode('utf-8')
 
         # Send file
-        with open(filepath, 'rb') as f:
-            await update.message.reply_document(
-                document=f,
-                filename=filename,
-                caption=f"Pothole data export\nTotal records: {len(df)}"
-
-            )
+        await update.message.reply_document(
+            document=csv_bytes,
+            filename=filename,
+            caption=f"Pothole data export\nTotal records: {len(df)}",
+            read_timeout=120,
+            write_timeout=120
+        )
 
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Send detailed help message"""
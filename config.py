@@ -28,6 +28,7 @@ class Config:
 
     #Output Video Configuration
     SAVE_VIDEO: bool = os.getenv('SAVE_VIDEO', 'True') == 'True'  # Set to True only when you want to save a video
+    SHOW_VIDEO: bool = os.getenv('SHOW_VIDEO', 'True') == 'True'  # Set to False on headless deployments, skips the preview window
     VIDEO_OUTPUT_PATH: str = os.getenv('VIDEO_OUTPUT_PATH', '.output/demo_output.avi')  # Or .mp4 if supported
     VIDEO_FPS: int = int(os.getenv('VIDEO_FPS', 20))  # Adjust FPS based on input video
 
@@ -46,6 +47,7 @@ class Config:
     DATA_DIR: str = os.getenv('DATA_DIR', 'data')
     OFFLINE_LOG_DIR: str = ''
     EXPORT_DIR: str = ''
+    GEOCODING_CACHE_PATH: str = ''
 
     # Detection Parameters
     DUPLICATE_RADIUS_METERS: float = float(os.getenv('DUPLICATE_RADIUS_METERS', 5.0))  
@@ -54,6 +56,7 @@ class Config:
     def __post_init__(self):
         self.OFFLINE_LOG_DIR = os.path.join(self.DATA_DIR, 'offline_logs')
         self.EXPORT_DIR = os.path.join(self.DATA_DIR, 'exports')
+        self.GEOCODING_CACHE_PATH = os.path.join(self.DATA_DIR, 'geocoding_cache.db')
 
         # Create directories if they don't exist
         os.makedirs(self.OFFLINE_LOG_DIR, exist_ok=True)
@@ -2,13 +2,15 @@ import sqlite3
 from contextlib import contextmanager
 import json
 import os
+from pathlib import Path
 from datetime import datetime
 from typing import List, Optional, Dict
 import logging
+import numpy as np
 
 from config import config
 from models import Pothole, Severity
-from utils import calculate_distance
+from utils import any_within_radius, bounding_box
 
 logger = logging.getLogger(__name__)
 
@@ -22,8 +24,14 @@ class PotholeDatabase:
         self.init_database()
 
     @contextmanager
-    def get_connection(self):
-        conn = sqlite3.connect(self.db_path)
+    def get_connection(self, readonly: bool = False):
+        # Bot queries use read-only connections; with WAL they never block the detection writes
+        if readonly:
+            # as_uri() escapes '#', '?' and '%' and handles Windows drive paths
+            uri = Path(self.db_path).resolve().as_uri() + "?mode=ro"
+            conn = sqlite3.connect(uri, uri=True)
+        else:
+            conn = sqlite3.connect(self.db_path)
         conn.row_factory = sqlite3.Row
         try:
             yield conn
@@ -37,6 +45,8 @@ class PotholeDatabase:
     def init_database(self):
         with self.get_connection() as conn:
             cur = conn.cursor()
+            # WAL lets readers and the writer run concurrently instead of locking each other out
+            cur.execute("PRAGMA journal_mode=WAL")
             cur.execute("""
                 CREATE TABLE IF NOT EXISTS potholes (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -60,66 +70,98 @@ class PotholeDatabase:
 
     def is_duplicate(self, latitude: float, longitude: float) -> bool:
         with self.get_connection() as conn:
-            cur = conn.cursor()
-            cur.execute("SELECT latitude, longitude FROM potholes")
-            for row in cur.fetchall():
-                distance = calculate_distance(
-                    latitude, longitude,
-                    row['latitude'], row['longitude']
-                )
-                if distance <= config.DUPLICATE_RADIUS_METERS:
-                    return True
-        return False
+            return self._is_duplicate(conn.cursor(), latitude, longitude)
+
+    def _is_duplicate(self, cur, latitude: float, longitude: float) -> bool:
+        # Only rows inside the bounding box can be within the radius; idx_location serves
+        # the range query so we don't compute distances against the whole table
+        min_lat, max_lat, min_lon, max_lon = bounding_box(latitude, longitude, config.DUPLICATE_RADIUS_METERS)
+        cur.execute("""
+            SELECT latitude, longitude FROM potholes
+            WHERE latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?
+        """, (min_lat, max_lat, min_lon, max_lon))
+        rows = cur.fetchall()
+        if not rows:
+            return False
+        # One vectorized pass over the candidates instead of a haversine call per row
+        coords = np.array(rows, dtype=np.float64)
+        return any_within_radius(latitude, longitude, coords, config.DUPLICATE_RADIUS_METERS)
 
     def add_pothole(self, pothole: Pothole) -> Optional[int]:
-        if self.is_duplicate(pothole.latitude, pothole.longitude):
-            logger.info(f"Duplicate pothole at ({pothole.latitude}, {pothole.longitude})")
-            return None
+        return self.add_potholes([pothole])[0]
 
+    def add_potholes(self, potholes: List[Pothole]) -> List[Optional[int]]:
+        """Insert potholes in a single transaction, returns new ids (None for duplicates)"""
+        ids = []
         with self.get_connection() as conn:
             cur = conn.cursor()
-            cur.execute("""
-                INSERT INTO potholes
-                (latitude, longitude, city, region, severity, area, depth,
-                 confidence, timestamp, image_path)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                pothole.latitude, pothole.longitude, pothole.city,
-                pothole.region, pothole.severity.value, pothole.area,
-                pothole.depth, pothole.confidence,
-                pothole.timestamp.isoformat(), pothole.image_path
-            ))
-            return cur.lastrowid
-
-    def get_potholes(self, filters: Dict = None, sort_by: str = 'timestamp',
-                     sort_order: str = 'DESC', limit: int = None) -> List[Pothole]:
-        query = "SELECT * FROM potholes WHERE 1=1"
+            for pothole in potholes:
+                # Runs inside the transaction, so earlier potholes of the batch count too
+                if self._is_duplicate(cur, pothole.latitude, pothole.longitude):
+                    logger.info(f"Duplicate pothole at ({pothole.latitude}, {pothole.longitude})")
+                    ids.append(None)
+                    continue
+
+                cur.execute("""
+                    INSERT INTO potholes
+                    (latitude, longitude, city, region, severity, area, depth,
+                     confidence, timestamp, image_path)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, (
+                    pothole.latitude, pothole.longitude, pothole.city,
+                    pothole.region, pothole.severity.value, pothole.area,
+                    pothole.depth, pothole.confidence,
+                    pothole.timestamp.isoformat(), pothole.image_path
+                ))
+                ids.append(cur.lastrowid)
+        return ids
+
+    @staticmethod
+    def _filter_clause(filters: Dict = None) -> tuple:
+        where = " WHERE 1=1"
         params = []
 
         if filters:
             if 'region' in filters:
-                query += " AND region = ?"
+                where += " AND region = ?"
                 params.append(filters['region'])
             if 'severity' in filters:
-                query += " AND severity = ?"
+                where += " AND severity = ?"
                 params.append(filters['severity'])
             if 'start_date' in filters:
-                query += " AND timestamp >= ?"
+                where += " AND timestamp >= ?"
                 params.append(filters['start_date'])
             if 'end_date' in filters:
-                query += " AND timestamp <= ?"
+                where += " AND timestamp <= ?"
                 params.append(filters['end_date'])
 
+        return where, params
+
+    def count_potholes(self, filters: Dict = None) -> int:
+        where, params = self._filter_clause(filters)
+        with self.get_connection(readonly=True) as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT COUNT(*) FROM potholes" + where, params)
+            return cur.fetchone()[0]
+
+    def get_potholes(self, filters: Dict = None, sort_by: str = 'timestamp',
+                     sort_order: str = 'DESC', limit: int = None, offset: int = None) -> List[Pothole]:
+        where, params = self._filter_clause(filters)
+        query = "SELECT * FROM potholes" + where
+
         valid_sort_columns = ['timestamp', 'severity', 'depth', 'area', 'confidence']
         if sort_by not in valid_sort_columns:
             sort_by = 'timestamp'
 
-        query += f" ORDER BY {sort_by} {sort_order}"
+        # id breaks ties so LIMIT/OFFSET pages don't overlap or skip rows
+        query += f" ORDER BY {sort_by} {sort_order}, id {sort_order}"
 
         if limit:
-            query += f" LIMIT {limit}"
+            query += f" LIMIT {int(limit)}"
+            if offset:
+                query += f" OFFSET {int(offset)}"
 
-        with self.get_connection() as conn:
+        with self.get_connection(readonly=True) as conn:
             cur = conn.cursor()
             cur.execute(query, params)
             rows = cur.fetchall()
@@ -141,8 +183,35 @@ class PotholeDatabase:
                 for row in rows
             ]
 
+    def get_coordinates(self) -> List[tuple]:
+        """(latitude, longitude) of every pothole, newest first, without building Pothole objects"""
+        with self.get_connection(readonly=True) as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT latitude, longitude FROM potholes ORDER BY timestamp DESC")
+            return [(row['latitude'], row['longitude']) for row in cur.fetchall()]
+
+    def get_region_counts(self) -> Dict[str, int]:
+        """Number of potholes per region, sorted by region name"""
+        with self.get_connection(readonly=True) as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT region, COUNT(*) AS count
+                FROM potholes
+                WHERE region IS NOT NULL AND region != ''
+                GROUP BY region
+                ORDER BY region
+            """)
+            return {row['region']: row['count'] for row in cur.fetchall()}
+
+    def get_fingerprint(self) -> tuple:
+        """Cheap (row count, last id) pair that changes whenever potholes are added"""
+        with self.get_connection(readonly=True) as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT COUNT(*), MAX(id) FROM potholes")
+            return tuple(cur.fetchone())
+
     def get_statistics(self) -> Dict:
-        with self.get_connection() as conn:
+        with self.get_connection(readonly=True) as conn:
             cur = conn.cursor()
 
             cur.execute("SELECT COUNT(*) AS total FROM potholes")
@@ -202,40 +271,45 @@ class PotholeDatabase:
         if not os.path.exists(config.OFFLINE_LOG_DIR):
             return
 
-        for filename in os.listdir(config.OFFLINE_LOG_DIR):
-            if filename.endswith('.json'):
-                filepath = os.path.join(config.OFFLINE_LOG_DIR, filename)
-                try:
-                    with open(filepath, 'r') as f:
-                        data = json.load(f)
-
-                    for item in data:
-                        pothole = Pothole(
-                            latitude=float(item['latitude']),
-                            longitude=float(item['longitude']),
-                            city=item['city'],
-                            region=item['region'],
-                            severity=Severity(item['severity']),
-                            area=float(item['area']),
-                            depth=float(item['depth']),
-                            confidence=float(item['confidence']),
-                            timestamp=datetime.fromisoformat(item['timestamp']),
-                            image_path=item.get('image_path')
-                        )
-                        self.add_pothole(pothole)
-
-                    # Remove synced file
-                    os.remove(filepath)
-                    logger.info(f"Synced and removed offline log: {filename}")
-
-                except json.JSONDecodeError as e:
-                    logger.error(f"Corrupted JSON file {filename}: {e}")
-                    # Optionally move corrupted file to a backup directory
-                    backup_dir = os.path.join(config.OFFLINE_LOG_DIR, 'corrupted')
-                    os.makedirs(backup_dir, exist_ok=True)
-                    os.rename(filepath, os.path.join(backup_dir, filename))
-                    logger.info(f"Moved corrupted file to {backup_dir}")
-
-                except Exception as e:
-                    logger.error(f"Error syncing offline log {filename}: {e}")
+        # One directory pass; the .json names and paths come straight from the dir entries
+        with os.scandir(config.OFFLINE_LOG_DIR) as entries:
+            log_files = [(entry.name, entry.path) for entry in entries
+                         if entry.name.endswith('.json') and entry.is_file()]
+
+        for filename, filepath in log_files:
+            try:
+                with open(filepath, 'r') as f:
+                    data = json.load(f)
+
+                potholes = [
+                    Pothole(
+                        latitude=float(item['latitude']),
+                        longitude=float(item['longitude']),
+                        city=item['city'],
+                        region=item['region'],
+                        severity=Severity(item['severity']),
+                        area=float(item['area']),
+                        depth=float(item['depth']),
+                        confidence=float(item['confidence']),
+                        timestamp=datetime.fromisoformat(item['timestamp']),
+                        image_path=item.get('image_path')
+                    )
+                    for item in data
+                ]
+                self.add_potholes(potholes)
+
+                # Remove synced file
+                os.remove(filepath)
+                logger.info(f"Synced and removed offline log: {filename}")
+
+            except json.JSONDecodeError as e:
+                logger.error(f"Corrupted JSON file {filename}: {e}")
+                # Optionally move corrupted file to a backup directory
+                backup_dir = os.path.join(config.OFFLINE_LOG_DIR, 'corrupted')
+                os.makedirs(backup_dir, exist_ok=True)
+                os.rename(filepath, os.path.join(backup_dir, filename))
+                logger.info(f"Moved corrupted file to {backup_dir}")
+
+            except Exception as e:
+                logger.error(f"Error syncing offline log {filename}: {e}")
 
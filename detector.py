@@ -4,6 +4,7 @@ import torch
 import torch.nn as nn
 from ultralytics import YOLO
 import logging
+from bisect import bisect_right
 from datetime import datetime
 from typing import Tuple,  List, Dict
 import os
@@ -14,6 +15,22 @@ from models import Pothole, Severity
 
 logger = logging.getLogger(__name__)
 
+# Weighted scoring system: area (px) and depth (cm) bands each score 10-50 points,
+# the total score maps to a severity. All 4x4 band combinations are precomputed.
+_AREA_BAND_EDGES = (500, 1500, 3000)
+_DEPTH_BAND_EDGES_CM = (2, 5, 10)
+_BAND_SCORES = (10, 20, 35, 50)
+_TOTAL_SCORE_EDGES = (25, 50, 75)
+_SCORE_SEVERITIES = (Severity.LOW, Severity.MEDIUM, Severity.HIGH, Severity.CRITICAL)
+_SEVERITY_TABLE = tuple(
+    tuple(_SCORE_SEVERITIES[bisect_right(_TOTAL_SCORE_EDGES, area_score + depth_score)]
+          for depth_score in _BAND_SCORES)
+    for area_score in _BAND_SCORES
+)
+
+# (average, max) depth in meters used when MiDaS can't provide one
+_DEFAULT_DEPTH_METERS = (0.03, 0.05)
+
 # Import MiDaS components directly
 sys.path.append(os.path.join(os.path.dirname(__file__), 'MiDaS'))
 
@@ -94,50 +111,57 @@ class PotholeDetector:
         transform = self._create_transform()
         return model, transform
 
-    def estimate_depth(self, image: np.ndarray, mask: np.ndarray) -> Tuple[float, float, np.ndarray]:
-        """
-        Estimate depth of pothole using MiDaS
-        Returns: (average_depth, max_depth, depth_map) in meters
-        """
-        try:
-            # Prepare image for MiDaS
-            img_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    def predict_depth_map(self, image: np.ndarray) -> np.ndarray:
+        """Run MiDaS on the whole image and return the scaled inverse depth map"""
+        # Prepare image for MiDaS
+        img_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
 
-            # Apply MiDaS transform
-            input_batch = self.midas_transform(img_rgb).to(self.device)
+        # Apply MiDaS transform
+        input_batch = self.midas_transform(img_rgb).to(self.device)
 
-            # Predict depth
-            with torch.no_grad():
-                prediction = self.midas_model(input_batch)
+        # Predict depth
+        with torch.no_grad():
+            prediction = self.midas_model(input_batch)
 
-                # Handle different output formats
-                if len(prediction.shape) == 3:
-                    prediction = prediction.unsqueeze(1)
+            # Handle different output formats
+            if len(prediction.shape) == 3:
+                prediction = prediction.unsqueeze(1)
 
-                # Resize to original image size
-                prediction = torch.nn.functional.interpolate(
-                    prediction,
-                    size=image.shape[:2],
-                    mode="bicubic",
-                    align_corners=False,
-                ).squeeze()
+            # Resize to original image size
+            prediction = torch.nn.functional.interpolate(
+                prediction,
+                size=image.shape[:2],
+                mode="bicubic",
+                align_corners=False,
+            ).squeeze()
 
-            # Convert to numpy
-            depth_map = prediction.cpu().numpy()
+        # Convert to numpy
+        depth_map = prediction.cpu().numpy()
 
-            # Normalize depth map
-            depth_map = np.abs(depth_map)
+        # Normalize depth map
+        depth_map = np.abs(depth_map)
 
-            # Avoid division by zero by creating a mask
-            valid_mask = depth_map > 0
-            depth_map_inv = np.zeros_like(depth_map)
+        # Avoid division by zero by creating a mask
+        valid_mask = depth_map > 0
+        depth_map_inv = np.zeros_like(depth_map)
 
-            # Invert only valid depth values
-            depth_map_inv[valid_mask] = 1.0 / depth_map[valid_mask]
+        # Invert only valid depth values
+        depth_map_inv[valid_mask] = 1.0 / depth_map[valid_mask]
 
-            # Scale the depth map to a reasonable range
-            DEPTH_SCALE_FACTOR = 0.5  # Adjust this based on your camera setup
-            depth_map_inv *= DEPTH_SCALE_FACTOR
+        # Scale the depth map to a reasonable range
+        DEPTH_SCALE_FACTOR = 0.5  # Adjust this based on your camera setup
+        depth_map_inv *= DEPTH_SCALE_FACTOR
+        return depth_map_inv
+
+    def estimate_depth(self, image: np.ndarray, mask: np.ndarray,
+                       depth_map: np.ndarray = None) -> Tuple[float, float, np.ndarray]:
+        """
+        Estimate depth of pothole using MiDaS
+        Pass a depth_map from predict_depth_map to reuse one inference for several masks
+        Returns: (average_depth, max_depth, depth_map) in meters
+        """
+        try:
+            depth_map_inv = depth_map if depth_map is not None else self.predict_depth_map(image)
 
             # Apply mask to get pothole region only
             mask_binary = mask.astype(bool)
@@ -180,54 +204,19 @@ class PotholeDetector:
 
             # Default values if calculation fails
             logger.warning("Using default depth values")
-            return 0.03, 0.05, depth_map_inv
+            return (*_DEFAULT_DEPTH_METERS, depth_map_inv)
 
         except Exception as e:
             logger.error(f"Error in depth estimation: {e}")
             # Return default values (3cm average, 5cm max)
-            return 0.03, 0.05, np.zeros_like(image[:, :, 0])
+            return (*_DEFAULT_DEPTH_METERS, np.zeros_like(image[:, :, 0]))
 
     def calculate_severity(self, area: float, depth: float) -> Severity:
         """Calculate severity based on both area and depth"""
-        # Convert depth to centimeters for easier comparison
-        depth_cm = depth * 100
-
-        # Weighted scoring system
-        area_score = 0
-        depth_score = 0
-
-        # Area scoring (0-50 points)
-        if area < 500:
-            area_score = 10
-        elif area < 1500:
-            area_score = 20
-        elif area < 3000:
-            area_score = 35
-        else:
-            area_score = 50
-
-        # Depth scoring in cm (0-50 points)
-        if depth_cm < 2:  # Less than 2cm
-            depth_score = 10
-        elif depth_cm < 5:  # Less than 5cm
-            depth_score = 20
-        elif depth_cm < 10:  # Less than 10cm
-            depth_score = 35
-        else:  # 10cm or more
-            depth_score = 50
-
-        # Total score
-        total_score = area_score + depth_score
-
-        # Determine severity
-        if total_score < 25:
-            return Severity.LOW
-        elif total_score < 50:
-            return Severity.MEDIUM
-        elif total_score < 75:
-            return Severity.HIGH
-        else:
-            return Severity.CRITICAL
+        # Depth bands are defined in centimeters
+        area_band = bisect_right(_AREA_BAND_EDGES, area)
+        depth_band = bisect_right(_DEPTH_BAND_EDGES_CM, depth * 100)
+        return _SEVERITY_TABLE[area_band][depth_band]
 
     def detect_potholes(self, image: np.ndarray, gps_data: Dict = None) -> Tuple[List[Pothole], np.ndarray]:
         """
@@ -237,6 +226,18 @@ class PotholeDetector:
         results = self.yolo_model.predict(image, conf=0.5)
         potholes = []
         annotated_image = image.copy()
+        depth_map = None
+        # Set when MiDaS fails, so a broken model isn't retried for every pothole
+        depth_failed = False
+
+        # All potholes in a frame share one GPS fix, so resolve its fields once
+        gps_data = gps_data or {}
+        latitude = gps_data.get('latitude', 0.0)
+        longitude = gps_data.get('longitude', 0.0)
+        city = gps_data.get('city', 'Unknown')
+        region = gps_data.get('region', 'Unknown')
+        # Every pothole in the frame was seen at the same moment
+        detected_at = datetime.now()
 
         for result in results:
             if result.masks is not None:
@@ -252,16 +253,29 @@ class PotholeDetector:
                     contours, _ = cv2.findContours(mask_binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
                     if contours:
-                        # Get the largest contour
-                        largest_contour = max(contours, key=cv2.contourArea)
-                        area = cv2.contourArea(largest_contour)
+                        # Get the largest contour, computing each contour area only once
+                        areas = [cv2.contourArea(contour) for contour in contours]
+                        largest_idx = max(range(len(areas)), key=areas.__getitem__)
+                        largest_contour = contours[largest_idx]
+                        area = areas[largest_idx]
 
                         # Skip very small detections
                         if area < 100:
                             continue
 
+                        # Run MiDaS at most once per frame, and only once a pothole needs it
+                        if depth_map is None and not depth_failed:
+                            try:
+                                depth_map = self.predict_depth_map(image)
+                            except Exception as e:
+                                logger.error(f"Error in depth estimation: {e}")
+                                depth_failed = True
+
                         # Estimate depth
-                        avg_depth, max_depth, depth_map = self.estimate_depth(image, mask_binary)
+                        if depth_failed:
+                            avg_depth, max_depth = _DEFAULT_DEPTH_METERS
+                        else:
+                            avg_depth, max_depth, _ = self.estimate_depth(image, mask_binary, depth_map)
 
                         # Calculate severity
                         severity = self.calculate_severity(area, avg_depth)
@@ -270,16 +284,17 @@ class PotholeDetector:
                         x1, y1, x2, y2 = box.xyxy[0].cpu().numpy().astype(int)
 
                         # Create Pothole object
+                        confidence = float(box.conf[0])
                         pothole = Pothole(
-                            latitude=gps_data.get('latitude', 0.0) if gps_data else 0.0,
-                            longitude=gps_data.get('longitude', 0.0) if gps_data else 0.0,
-                            city=gps_data.get('city', 'Unknown') if gps_data else 'Unknown',
-                            region=gps_data.get('region', 'Unknown') if gps_data else 'Unknown',
+                            latitude=latitude,
+                            longitude=longitude,
+                            city=city,
+                            region=region,
                             severity=severity,
                             area=area,
                             depth=avg_depth,
-                            confidence=float(box.conf[0]),
-                            timestamp=datetime.now()
+                            confidence=confidence,
+                            timestamp=detected_at
                         )
                         potholes.append(pothole)
 
@@ -294,7 +309,7 @@ class PotholeDetector:
                         # Add text annotation
                         label = f"{severity.value.upper()}"
                         depth_label = f"Depth: {avg_depth*100:.2f}cm"
-                        conf_label = f"Conf: {float(box.conf[0]):.2f}"
+                        conf_label = f"Conf: {confidence:.2f}"
 
                         cv2.putText(annotated_image, label, (x1, y1 - 25),
                                     cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
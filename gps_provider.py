@@ -1,124 +1,386 @@
+import atexit
+import sqlite3
 import serial
 import logging
+import selectors
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from abc import ABC, abstractmethod
 from geopy.geocoders import Nominatim
 
+from config import config
+
 logger = logging.getLogger(__name__)
 
+# Number of degree digits in an NMEA coordinate, by hemisphere
+_NMEA_DEGREE_DIGITS = {'N': 2, 'S': 2, 'E': 3, 'W': 3}
+
+# Sentence prefix -> (index of the latitude field, minimum field count, index of the
+# status field or None). Anything else (GSV, GSA, VTG...) is rejected before decoding.
+_NMEA_SENTENCES = {
+    b'$GPGGA': (2, 6, None),
+    b'$GPRMC': (3, 7, 2),
+}
+
+
+class _SerialSelector:
+    """Single background thread that wakes only when a registered serial port is readable"""
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def register(self, receiver):
+        with self._lock:
+            self._selector.register(receiver.ser.fileno(), selectors.EVENT_READ, receiver)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='gps-selector', daemon=True)
+                self._thread.start()
+
+    def unregister(self, receiver):
+        with self._lock:
+            try:
+                self._selector.unregister(receiver.ser.fileno())
+            except (KeyError, ValueError, OSError):
+                pass
+
+    def _run(self):
+        while True:
+            for key, _ in self._selector.select(timeout=1.0):
+                receiver = key.data
+                try:
+                    receiver.update()
+                except Exception as e:
+                    logger.error(f"GPS reading error: {e}")
+                    self.unregister(receiver)
+
+
+_serial_selector = _SerialSelector()
+
 
 class BaseGPS(ABC):
+    def __init__(self):
+        # Bounded LRU of recent buckets; older ones are looked up in SQLite on demand
+        self._cache_size = 4096
+        self.geocoding_cache = self._load_geocoding_cache()
+        # Entries resolved since the last flush, guarded by _inflight_lock
+        self._pending = {}
+        self._save_interval = 100
+        self._save_lock = threading.Lock()
+        # Nominatim is rate limited, so lookups are serialized on one background worker.
+        # Only the newest missed bucket waits for it; older ones are stale once the vehicle moved on.
+        self._geocoding_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='geocoder')
+        self._inflight_key = None
+        self._next_lookup = None
+        self._lookup_scheduled = False
+        self._inflight_lock = threading.Lock()
+        # City and region don't change between neighbouring buckets, so a miss reuses the last answer
+        self._last_location = ('Unknown', 'Unknown')
+        # Persist pending entries even if close() is never reached
+        atexit.register(self._flush_geocoding_cache)
+
     @abstractmethod
     def get_gps_data(self):
         pass
 
+    def _load_geocoding_cache(self):
+        try:
+            conn = sqlite3.connect(config.GEOCODING_CACHE_PATH)
+            try:
+                with conn:
+                    conn.execute("""
+                        CREATE TABLE IF NOT EXISTS geocoding_cache (
+                            key TEXT PRIMARY KEY,
+                            city TEXT,
+                            region TEXT
+                        )
+                    """)
+                # Most recently stored entries first
+                rows = conn.execute(
+                    "SELECT key, city, region FROM geocoding_cache ORDER BY rowid DESC LIMIT ?",
+                    (self._cache_size,)
+                ).fetchall()
+            finally:
+                conn.close()
+            return OrderedDict((self._parse_cache_key(key), (city, region)) for key, city, region in reversed(rows))
+        except Exception as e:
+            logger.warning(f"Could not load geocoding cache: {e}")
+            return OrderedDict()
+
+    def _load_cached_location(self, cache_key):
+        """Look up a bucket that is not in memory in the cache database"""
+        try:
+            conn = sqlite3.connect(config.GEOCODING_CACHE_PATH)
+            try:
+                row = conn.execute(
+                    "SELECT city, region FROM geocoding_cache WHERE key = ?",
+                    (self._format_cache_key(cache_key),)
+                ).fetchone()
+            finally:
+                conn.close()
+            return tuple(row) if row else None
+        except Exception as e:
+            logger.debug(f"Geocoding cache lookup error: {e}")
+            return None
+
+    @staticmethod
+    def _parse_cache_key(key):
+        """Convert a stored 'lat,lon' key into the in-memory integer bucket"""
+        lat, lon = key.split(',')
+        return round(float(lat) * 10000), round(float(lon) * 10000)
+
+    @staticmethod
+    def _format_cache_key(cache_key):
+        lat_key, lon_key = cache_key
+        return f"{lat_key / 10000:.4f},{lon_key / 10000:.4f}"
+
+    def _save_geocoding_cache(self):
+        """Append the entries resolved since the last flush to the cache database"""
+        with self._inflight_lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        with self._save_lock:
+            try:
+                conn = sqlite3.connect(config.GEOCODING_CACHE_PATH)
+                try:
+                    with conn:
+                        conn.executemany(
+                            "INSERT OR REPLACE INTO geocoding_cache (key, city, region) VALUES (?, ?, ?)",
+                            [(self._format_cache_key(key), city, region)
+                             for key, (city, region) in pending.items()]
+                        )
+                finally:
+                    conn.close()
+            except Exception as e:
+                logger.error(f"Error saving geocoding cache: {e}")
+                # Keep the entries so the next flush retries them
+                with self._inflight_lock:
+                    pending.update(self._pending)
+                    self._pending = pending
+
+    def _get_location_info(self, lat, lon):
+        # ~10 m buckets so consecutive fixes along a road share an entry; an int
+        # tuple hashes faster than a formatted string and needs no formatting
+        cache_key = (round(lat * 10000), round(lon * 10000))
+
+        # Never block the caller on Nominatim: resolve in the background and let
+        # later fixes in the same bucket pick the result up from the cache
+        with self._inflight_lock:
+            # Under the lock, since the geocoder thread inserts and evicts entries
+            cached = self.geocoding_cache.get(cache_key)
+            if cached is not None:
+                self.geocoding_cache.move_to_end(cache_key)
+                self._last_location = cached
+                return cached
+            if cache_key != self._inflight_key:
+                # Replaces any bucket still waiting, it's behind the vehicle by now
+                self._next_lookup = (cache_key, lat, lon)
+                if not self._lookup_scheduled:
+                    self._lookup_scheduled = True
+                    self._geocoding_executor.submit(self._drain_lookups)
+            return self._last_location
+
+    def _drain_lookups(self):
+        """Runs on the geocoder thread: resolve the newest missed bucket until none is left"""
+        while True:
+            with self._inflight_lock:
+                if self._next_lookup is None:
+                    self._lookup_scheduled = False
+                    return
+                cache_key, lat, lon = self._next_lookup
+                self._next_lookup = None
+                self._inflight_key = cache_key
+
+            self._on_geocoded(cache_key, self._resolve_location(cache_key, lat, lon))
+
+    def _resolve_location(self, cache_key, lat, lon):
+        """Runs on the geocoder thread: the cache database first, then Nominatim"""
+        stored = self._load_cached_location(cache_key)
+        if stored is not None:
+            return stored
+
+        result = self._reverse_geocode(lat, lon)
+        if result is not None:
+            with self._inflight_lock:
+                self._pending[cache_key] = result
+        return result
+
+    def _reverse_geocode(self, lat, lon):
+        try:
+            location = self.geolocator.reverse((lat, lon), timeout=5)
+            if location and location.raw.get('address'):
+                address = location.raw['address']
+                return address.get('city', address.get('town', 'Unknown')), address.get('state', 'Unknown')
+            return 'Unknown', 'Unknown'
+        except Exception as e:
+            logger.debug(f"Geocoding error: {e}")
+            return None
+
+    def _on_geocoded(self, cache_key, result):
+        with self._inflight_lock:
+            # Don't cache failures, the lookup may succeed on the next fix
+            if result is not None:
+                self.geocoding_cache[cache_key] = result
+                if len(self.geocoding_cache) > self._cache_size:
+                    self.geocoding_cache.popitem(last=False)
+                self._last_location = result
+            self._inflight_key = None
+
+        # Write-behind: only flush to disk every _save_interval new entries
+        if len(self._pending) >= self._save_interval:
+            self._save_geocoding_cache()
+
+    def _flush_geocoding_cache(self):
+        if self._pending:
+            self._save_geocoding_cache()
+
+    def close(self):
+        with self._inflight_lock:
+            self._next_lookup = None
+        self._geocoding_executor.shutdown(wait=False, cancel_futures=True)
+        self._flush_geocoding_cache()
+
 
 class RealGPS(BaseGPS):
     def __init__(self, port, baudrate):
+        super().__init__()
         self.ser = None
         self.port = port
         self.baudrate = baudrate
         self.geolocator = Nominatim(user_agent="pothole_detector")
+        # Written only by the reader thread; attribute binding is atomic under the GIL
+        self._latest = None
+        self._rx_buffer = bytearray()
+        self._use_selector = False
+        self._reader_thread = None
+        self._stop_reading = threading.Event()
         try:
             self.ser = serial.Serial(port, baudrate, timeout=1)
             logger.info("GPS serial port opened")
         except Exception as e:
             logger.warning(f"Could not open GPS port: {e}")
+            return
 
-    def get_gps_data(self):
         try:
-            if not self.ser or not self.ser.is_open:
-                return None
-
-            line = self.ser.readline().decode('utf-8', errors='ignore').strip()
-            if not line:
-                return None
-
-            lat, lon = self._parse_nmea_sentence(line)
-            if lat is not None and lon is not None:
-                city, region = self._get_location_info(lat, lon)
-                return {
-                    'latitude': lat,
-                    'longitude': lon,
-                    'city': city,
-                    'region': region
-                }
-        except Exception as e:
-            logger.error(f"GPS reading error: {e}")
+            _serial_selector.register(self)
+            self._use_selector = True
+        except (AttributeError, OSError, ValueError) as e:
+            # e.g. Windows COM ports have no selectable file descriptor, so they get
+            # their own thread and blocking reads never stall the video loop
+            logger.debug(f"GPS port not selectable, reading it on a dedicated thread: {e}")
+            self._reader_thread = threading.Thread(target=self._read_loop, name='gps-reader', daemon=True)
+            self._reader_thread.start()
+
+    def update(self):
+        """Consume the bytes available on the serial port and record complete fixes"""
+        self._rx_buffer += self.ser.read(self.ser.in_waiting or 1)
+        *lines, self._rx_buffer = self._rx_buffer.split(b'\n')
+        for line in lines:
+            fix = self._read_fix(line.strip())
+            if fix:
+                self._latest = fix
+
+    def _read_loop(self):
+        """Blocking readline loop for ports that can't be registered with the selector"""
+        while not self._stop_reading.is_set():
+            try:
+                line = self.ser.readline().strip()
+            except Exception as e:
+                logger.error(f"GPS reading error: {e}")
+                return
+            fix = self._read_fix(line)
+            if fix:
+                self._latest = fix
+
+    def get_gps_data(self):
+        # Never blocks: the reader thread keeps the most recent fix up to date
+        return self._latest
+
+    def _read_fix(self, line):
+        if not line:
+            return None
+
+        lat, lon = self._parse_nmea_sentence(line)
+        if lat is not None and lon is not None:
+            city, region = self._get_location_info(lat, lon)
+            return {
+                'latitude': lat,
+                'longitude': lon,
+                'city': city,
+                'region': region
+            }
         return None
 
     def _parse_nmea_sentence(self, sentence):
+        """Parse a raw NMEA line (bytes) into (lat, lon)"""
+        layout = _NMEA_SENTENCES.get(bytes(sentence[:6]))
+        if layout is None:
+            return None, None
+
+        lat_field, min_fields, status_field = layout
         try:
-            parts = sentence.split(',')
-            if parts[0] == '$GPGGA' and len(parts) >= 6:
-                lat = self._nmea_to_decimal(parts[2], parts[3])
-                lon = self._nmea_to_decimal(parts[4], parts[5])
-                return lat, lon
-            elif parts[0] == '$GPRMC' and len(parts) >= 7 and parts[2] == 'A':
-                lat = self._nmea_to_decimal(parts[3], parts[4])
-                lon = self._nmea_to_decimal(parts[5], parts[6])
+            parts = sentence.decode('ascii', errors='ignore').split(',')
+            if len(parts) >= min_fields and (status_field is None or parts[status_field] == 'A'):
+                lat = self._nmea_to_decimal(parts[lat_field], parts[lat_field + 1])
+                lon = self._nmea_to_decimal(parts[lat_field + 2], parts[lat_field + 3])
                 return lat, lon
         except Exception as e:
             logger.debug(f"NMEA parse error: {e}")
         return None, None
 
     def _nmea_to_decimal(self, coord_str, direction):
-        try:
-            if not coord_str or '.' not in coord_str:
-                return 0.0
-
-            if direction in ['N', 'S']:
-                degrees = int(coord_str[:2])
-                minutes = float(coord_str[2:])
-            else:
-                degrees = int(coord_str[:3])
-                minutes = float(coord_str[3:])
-
-            decimal = degrees + minutes / 60.0
-            if direction in ['S', 'W']:
-                decimal *= -1
-            return decimal
-        except:
+        if not coord_str or '.' not in coord_str:
             return 0.0
 
-    def _get_location_info(self, lat, lon):
+        # ddmm.mmmm for latitude, dddmm.mmmm for longitude
+        degree_digits = _NMEA_DEGREE_DIGITS.get(direction, 3)
         try:
-            location = self.geolocator.reverse((lat, lon), timeout=5)
-            if location and location.raw.get('address'):
-                address = location.raw['address']
-                return address.get('city', address.get('town', 'Unknown')), address.get('state', 'Unknown')
-        except Exception as e:
-            logger.debug(f"Geocoding error: {e}")
-        return 'Unknown', 'Unknown'
+            decimal = int(coord_str[:degree_digits]) + float(coord_str[degree_digits:]) / 60.0
+        except ValueError:
+            return 0.0
+        return -decimal if direction in ('S', 'W') else decimal
 
     def close(self):
+        if self._use_selector:
+            _serial_selector.unregister(self)
+            self._use_selector = False
+        if self._reader_thread:
+            self._stop_reading.set()
+            # readline() returns within the port timeout
+            self._reader_thread.join(timeout=2)
+            self._reader_thread = None
         if self.ser and self.ser.is_open:
             self.ser.close()
+        super().close()
 
 
 class SimulatedGPS(BaseGPS):
     def __init__(self):
+        super().__init__()
         self.geolocator = Nominatim(user_agent="pothole_detector_sim")
+        self._fix = None
 
     def get_gps_data(self):
+        # The simulated position never moves, so once it is resolved the same fix is shared
+        if self._fix is not None:
+            return self._fix
+
         try:
             lat, lon = 44.7866, 20.4489  # Belgrade
             city, region = self._get_location_info(lat, lon)
-            return {
+            fix = {
                 'latitude': lat,
                 'longitude': lon,
                 'city': city,
                 'region': region
             }
+            if region != 'Unknown':
+                self._fix = fix
+            return fix
         except Exception as e:
             logger.debug(f"Simulated GPS error: {e}")
             return None
-
-    def _get_location_info(self, lat, lon):
-        try:
-            location = self.geolocator.reverse((lat, lon), timeout=5)
-            if location and location.raw.get('address'):
-                address = location.raw['address']
-                return address.get('city', address.get('town', 'Unknown')), address.get('state', 'Unknown')
-        except Exception as e:
-            logger.debug(f"Simulated geocoding error: {e}")
-        return 'Unknown', 'Unknown'
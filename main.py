@@ -1,10 +1,11 @@
+import asyncio
 import cv2
-import serial
 import logging
 import threading
-import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from queue import Queue
+from queue import Queue, Empty, Full
 from geopy.geocoders import Nominatim
 
 from config import config
@@ -20,6 +21,67 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Formatted lazily by logging, only when the record is actually emitted
+NEW_POTHOLE_LOG = "New pothole detected: ID=%s, Severity=%s, Depth=%.3fm, Location=(%.6f, %.6f)"
+
+
+class FrameGrabber:
+    """Capture thread that decodes only the frames the detector will use"""
+
+    def __init__(self, cap, frame_skip, live):
+        self.cap = cap
+        self.frame_skip = frame_skip
+        self.live = live
+        self.frames = Queue(maxsize=2)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='frame-grabber', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                # grab() only demuxes; skipped frames are never decoded
+                for _ in range(self.frame_skip - 1):
+                    if not self.cap.grab():
+                        return
+                ret, frame = self.cap.read()
+                if not ret:
+                    return
+                self._put(frame)
+        finally:
+            self._put(None)
+
+    def _put(self, frame):
+        if self.live:
+            # A live feed should show the newest frame, so drop the oldest one
+            while True:
+                try:
+                    self.frames.put_nowait(frame)
+                    return
+                except Full:
+                    try:
+                        self.frames.get_nowait()
+                    except Empty:
+                        pass
+        # Video files must not lose frames, wait for the consumer instead
+        while not self._stop.is_set():
+            try:
+                self.frames.put(frame, timeout=0.1)
+                return
+            except Full:
+                pass
+
+    def read(self):
+        """Next kept frame, or None once the source is exhausted"""
+        return self.frames.get()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=2)
+
 
 class PotholeDetectionSystem:
     def __init__(self):
@@ -29,6 +91,9 @@ class PotholeDetectionSystem:
         self.geolocator = Nominatim(user_agent="pothole_detector")
         self.detection_queue = Queue()
         self.running = False
+        self.stop_event = threading.Event()
+        # A single worker keeps frames in order, so duplicate checks see earlier frames
+        self.io_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pothole-io')
         if config.USE_SIMULATION:
             self.gps = SimulatedGPS()
         else:
@@ -37,25 +102,19 @@ class PotholeDetectionSystem:
     def process_video(self):
         """Main video processing loop"""
         self.running = True
-        ser = None
         cap = None
+        grabber = None
         video_writer = None
 
         try:
-            # Initialize serial port (for fallback legacy method)
-            try:
-                ser = serial.Serial(config.GPS_PORT, config.GPS_BAUDRATE, timeout=1)
-                logger.info("GPS serial port opened")
-            except Exception as e:
-                logger.warning(f"Could not open GPS port: {e}. Continuing without legacy GPS.")
-
-
             # Open video or webcam
             if config.USE_LIVE_CAMERA:
                 cap = cv2.VideoCapture(config.CAMERA_INDEX)
                 logger.info("Using live webcam feed.")
                 cap.set(cv2.CAP_PROP_FRAME_WIDTH, config.VIDEO_WIDTH)
                 cap.set(cv2.CAP_PROP_FRAME_HEIGHT, config.VIDEO_HEIGHT)
+                # Keep only the newest frame in the driver so we never process stale ones
+                cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
             else:
                 cap = cv2.VideoCapture(config.VIDEO_FILE)
                 logger.info(f"Using video file: {config.VIDEO_FILE}")
@@ -74,25 +133,30 @@ class PotholeDetectionSystem:
                 )
                 logger.info(f"Video recording enabled: {config.VIDEO_OUTPUT_PATH}")
 
-            frame_count = 0
             last_gps_data = None
 
-            while self.running and cap.isOpened():
-                ret, frame = cap.read()
-                if not ret:
-                    break
+            # Skipped frames are dropped by the grabber thread before they are decoded
+            grabber = FrameGrabber(cap, config.FRAME_SKIP, config.USE_LIVE_CAMERA).start()
 
-                frame_count += 1
+            # Loop invariants, looked up once instead of on every frame
+            frame_size = (config.VIDEO_WIDTH, config.VIDEO_HEIGHT)
+            show_video = config.SHOW_VIDEO
+            # Frames are resized into one reusable buffer; the detector annotates a copy
+            resize_buf = np.empty((config.VIDEO_HEIGHT, config.VIDEO_WIDTH, 3), dtype=np.uint8)
+            get_gps_data = self.gps.get_gps_data
+            detect_potholes = self.detector.detect_potholes
 
-                # Skip frames based on config
-                if frame_count % config.FRAME_SKIP != 0:
-                    continue
+            while self.running:
+                frame = grabber.read()
+                if frame is None:
+                    break
 
-                # Resize frame
-                frame = cv2.resize(frame, (config.VIDEO_WIDTH, config.VIDEO_HEIGHT))
+                # Resize frame, INTER_AREA is faster and sharper when downscaling
+                interpolation = cv2.INTER_AREA if frame.shape[1] > frame_size[0] else cv2.INTER_LINEAR
+                frame = cv2.resize(frame, frame_size, dst=resize_buf, interpolation=interpolation)
 
                 # Get GPS data
-                gps_data = self.gps.get_gps_data()
+                gps_data = get_gps_data()
                 if gps_data:
                     last_gps_data = gps_data
                 else:
@@ -104,57 +168,72 @@ class PotholeDetectionSystem:
                     cv2.putText(frame, gps_text, (10, 25), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 255), 2)
 
                 # Detect potholes
-                potholes, annotated_frame = self.detector.detect_potholes(frame, gps_data)
-
-                # Process detected potholes
-                for pothole in potholes:
-                    if gps_data and not self.db.is_duplicate(pothole.latitude, pothole.longitude):
-                        try:
-                            pothole_id = self.db.add_pothole(pothole)
-                            if pothole_id:
-                                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                                image_path = save_detection_image(annotated_frame, pothole_id, timestamp)
-                                logger.info(f"New pothole detected: ID={pothole_id}, "
-                                            f"Severity={pothole.severity.value}, "
-                                            f"Depth={pothole.depth:.3f}m, "
-                                            f"Location=({pothole.latitude:.6f}, {pothole.longitude:.6f})")
-                        except Exception as e:
-                            logger.error(f"Database error: {e}")
-                            self.db.save_offline_log([pothole])
+                potholes, annotated_frame = detect_potholes(frame, gps_data)
+
+                # Persist detected potholes off the frame loop
+                if potholes and gps_data:
+                    self.io_executor.submit(self._save_potholes, potholes, annotated_frame)
 
                 # Save frame to video if enabled
-                if config.SAVE_VIDEO and video_writer:
+                if video_writer:
                     video_writer.write(annotated_frame)
 
-                # Show live output
-                cv2.imshow('Pothole Detection', annotated_frame)
-                if cv2.waitKey(1) & 0xFF == ord('q'):
-                    break
+                # Show live output, headless runs are stopped through self.running instead of 'q'
+                if show_video:
+                    cv2.imshow('Pothole Detection', annotated_frame)
+                    if cv2.waitKey(1) & 0xFF == ord('q'):
+                        break
 
         except Exception as e:
             logger.error(f"Processing error: {e}")
 
         finally:
+            if grabber:
+                grabber.stop()
             if cap:
                 cap.release()
-            if ser and ser.is_open:
-                ser.close()
             if video_writer:
                 video_writer.release()
-            cv2.destroyAllWindows()
+            if config.SHOW_VIDEO:
+                cv2.destroyAllWindows()
+            # Let queued detections finish saving before reporting the loop as stopped
+            self.io_executor.shutdown(wait=True)
             self.running = False
+            self.stop_event.set()
             logger.info("Video processing stopped")
-            if isinstance(self.gps, RealGPS):
-                self.gps.close()
+            self.gps.close()
+
+    def _save_potholes(self, potholes, annotated_frame):
+        """Store one frame's potholes in a single transaction and save their images"""
+        try:
+            pothole_ids = self.db.add_potholes(potholes)
+        except Exception as e:
+            logger.error(f"Database error: {e}")
+            self.db.save_offline_log(potholes)
+            return
+
+        # All potholes of a frame share one second-resolution timestamp
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        for pothole, pothole_id in zip(potholes, pothole_ids):
+            if not pothole_id:
+                continue
+            try:
+                image_path = save_detection_image(annotated_frame, pothole_id, timestamp)
+                logger.info(NEW_POTHOLE_LOG, pothole_id, pothole.severity.value,
+                            pothole.depth, pothole.latitude, pothole.longitude)
+            except Exception as e:
+                logger.error(f"Error saving detection image: {e}")
 
-    def sync_offline_data(self):
-        """Periodically sync offline data"""
-        while self.running:
+    async def sync_offline_data(self):
+        """Periodically sync offline data, runs on the bot's event loop"""
+        while not self.stop_event.is_set():
             try:
-                self.db.sync_offline_logs()
+                # SQLite calls block, keep them off the event loop
+                await asyncio.to_thread(self.db.sync_offline_logs)
             except Exception as e:
                 logger.error(f"Sync error: {e}")
-            time.sleep(60)  # Sync every minute
+            # Sync every minute; the bot cancels this task on shutdown
+            await asyncio.sleep(60)
 
 
 
@@ -164,9 +243,8 @@ class PotholeDetectionSystem:
         video_thread = threading.Thread(target=self.process_video)
         video_thread.start()
 
-        # Start offline sync in a separate thread
-        sync_thread = threading.Thread(target=self.sync_offline_data)
-        sync_thread.start()
+        # Offline sync shares the bot's event loop instead of its own thread
+        self.bot.add_background_job(self.sync_offline_data)
 
         try:
             # Run bot in main thread
@@ -175,8 +253,8 @@ class PotholeDetectionSystem:
             logger.info("Shutting down...")
         finally:
             self.running = False
+            self.stop_event.set()
             video_thread.join()
-            sync_thread.join()
 
 
 def main():
@@ -5,9 +5,12 @@ import numpy as np
 from config import config
 
 
+EARTH_RADIUS_METERS = 6371000
+
+
 def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     """Calculate distance between two GPS coordinates in meters"""
-    R = 6371000  # Earth radius in meters
+    R = EARTH_RADIUS_METERS
     phi1 = math.radians(lat1)
     phi2 = math.radians(lat2)
     delta_phi = math.radians(lat2 - lat1)
@@ -19,6 +22,22 @@ def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> fl
     return R * c
 
 
+def bounding_box(latitude: float, longitude: float, radius_meters: float) -> tuple:
+    """Return (min_lat, max_lat, min_lon, max_lon) enclosing a circle of radius_meters"""
+    lat_delta = math.degrees(radius_meters / EARTH_RADIUS_METERS)
+    lon_delta = lat_delta / max(math.cos(math.radians(latitude)), 1e-6)
+    return latitude - lat_delta, latitude + lat_delta, longitude - lon_delta, longitude + lon_delta
+
+
+def any_within_radius(latitude: float, longitude: float, coords: np.ndarray, radius_meters: float) -> bool:
+    """Check if any (lat, lon) row of coords lies within radius_meters of the point.
+    Uses the equirectangular approximation, accurate well below 0.1% at these distances"""
+    dlat = np.radians(coords[:, 0] - latitude)
+    dlon = np.radians(coords[:, 1] - longitude) * math.cos(math.radians(latitude))
+    radius = radius_meters / EARTH_RADIUS_METERS
+    return bool(np.any(dlat * dlat + dlon * dlon <= radius * radius))
+
+
 def save_detection_image(image: np.ndarray, pothole_id: int, timestamp: str) -> str:
     """Save detection image and return the path"""
     filename = f"pothole_{pothole_id}_{timestamp}.jpg"